@@ -1,11 +1,16 @@
 import streamlit as st
 import geopandas as gpd
 import plotly.graph_objects as go
+import pydeck as pdk
+from plotly.colors import sample_colorscale, unlabel_rgb
 import pandas as pd
-from shapely.geometry import Point, Polygon, MultiPolygon
+import numpy as np
+import shapely
 import tempfile
 import requests
 import zipfile
+import hashlib
+import glob
 import os
 
 st.set_page_config(layout="wide")
@@ -15,101 +20,247 @@ st.title("BC Resource Region and OG District Visualization (EPSG:3005)")
 csv_url = "https://raw.githubusercontent.com/Baipzix/BCOGRegApp/main/data/Mock_OG_district.csv"
 zip_url = "https://github.com/Baipzix/BCOGRegApp/raw/main/data/BC_ResourceRegion.zip"
 
-def extract_coordinates(geometry):
-    x_coords, y_coords = [], []
-    if isinstance(geometry, Polygon):
-        x, y = zip(*geometry.exterior.coords)
-        x_coords.extend(x)
-        y_coords.extend(y)
-        x_coords.append(None)
-        y_coords.append(None)
-    elif isinstance(geometry, MultiPolygon):
-        for poly in geometry.geoms:
-            x, y = zip(*poly.exterior.coords)
-            x_coords.extend(x + (None,))
-            y_coords.extend(y + (None,))
-    return x_coords, y_coords
+# Districts without a Rate are drawn in this neutral grey instead of on the RdYlGn scale.
+MISSING_RATE_COLOR = (128, 128, 128)
 
-try:
-    # --- Download and read shapefile from GitHub ZIP ---
-    with tempfile.TemporaryDirectory() as tmpdir:
-        zip_path = os.path.join(tmpdir, "regions.zip")
-        with open(zip_path, "wb") as f:
-            f.write(requests.get(zip_url).content)
+# Downloads are refetched after this many seconds so edits to the GitHub data reach a running app.
+DOWNLOAD_TTL = 3600
+
+# --- Cached loaders (survive Streamlit reruns) ---
+@st.cache_resource(show_spinner=False, ttl=DOWNLOAD_TTL)
+def download_file(url):
+    # Streams url to disk in 1 MiB chunks; returns (path, blake2b digest). The file is
+    # named by its digest so a loader keyed on the digest always reads those bytes;
+    # older versions of the same url are removed once the new file is in place.
+    url_id = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+    prefix = os.path.join(tempfile.gettempdir(), f"bcogreg-{url_id}-")
+    ext = os.path.splitext(url)[1]
+    fd, tmp_path = tempfile.mkstemp(dir=tempfile.gettempdir())
+    digest = hashlib.blake2b()
+    try:
+        with os.fdopen(fd, "wb") as f, requests.get(url, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                digest.update(chunk)
+                f.write(chunk)
+        path = f"{prefix}{digest.hexdigest()[:16]}{ext}"
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    for old_path in glob.glob(glob.escape(prefix) + "*"):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:  # already removed by another session's refetch
+                pass
+    return path, digest.digest()
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_csv(csv_key, _csv_path):
+    # csv_key is the blake2b digest of the file at _csv_path; Streamlit hashes only the key.
+    return pd.read_csv(_csv_path)
 
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_shapefile(zip_key, _zip_path):
+    # zip_key is the blake2b digest of the file at _zip_path; Streamlit hashes only the key.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with zipfile.ZipFile(_zip_path, "r") as zip_ref:
             zip_ref.extractall(tmpdir)
 
         shp_files = [os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.endswith(".shp")]
         if not shp_files:
             raise FileNotFoundError("No .shp file found in the ZIP.")
-        gdf = gpd.read_file(shp_files[0])
+        gdf = gpd.read_file(shp_files[0], engine='pyogrio')
 
     if gdf.crs != 'EPSG:3005':
         gdf = gdf.to_crs(epsg=3005)
+    gdf.sindex  # build the STRtree once; the cached frame keeps it
+    # Display-only copy; the sindex join keeps the original borders. 100 m tolerance
+    # (EPSG:3005 units) is invisible at map zoom but drops most vertices. deck.gl
+    # draws lon/lat; follows gdf's row order, which the left merge on REGION_NAM keeps.
+    simplified = shapely.simplify(gdf.geometry.values, tolerance=100, preserve_topology=True)
+    region_lonlat = gpd.GeoSeries(simplified, crs=gdf.crs).to_crs(epsg=4326).values
+    return gdf, region_lonlat
 
-    # --- Load CSV from GitHub ---
-    df = pd.read_csv(csv_url)
-    df['geometry'] = df.apply(lambda row: Point(row['x'], row['y']), axis=1)
-    district_gdf = gpd.GeoDataFrame(df, geometry='geometry', crs='EPSG:3005')
-
-    # --- Spatial join ---
-    joined = gpd.sjoin(district_gdf, gdf[['REGION_NAM', 'geometry']], how='left', predicate='within')
-
-    # --- Aggregate stats ---
-    region_stats = joined.groupby('REGION_NAM').agg({'Rate': 'mean', 'Area': 'sum'}).reset_index()
-    gdf = gdf.merge(region_stats, on='REGION_NAM', how='left')
-
-    # --- UI for region selection ---
-    region_names = sorted(gdf['REGION_NAM'].dropna().unique().tolist())
-    selected_regions = st.multiselect("Select Resource Regions to Highlight", region_names)
-
-    # --- Main map ---
-    fig = go.Figure()
-
-    for idx, row in gdf.iterrows():
-        x, y = extract_coordinates(row.geometry)
-        region_name = row.get('REGION_NAM', f'Region {idx}')
-        is_selected = region_name in selected_regions
-
-        fig.add_trace(go.Scatter(
-            x=x, y=y, mode='lines', fill='toself',
-            fillcolor='lightblue' if is_selected else 'lightgrey',
-            line=dict(color='white', width=1),
-            hoverinfo='text',
-            text=f"Region: {region_name}<br>Rate: {row.get('Rate', float('nan')):.2f}<br>Area: {row.get('Area', float('nan')):.0f}",
-            showlegend=False
-        ))
+def compute_region_stats(gdf, df):
+    # Mean Rate and total Area of the districts inside each region, merged onto gdf.
+    district_gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df['x'], df['y']), crs='EPSG:3005')
 
-    # --- OG Districts ---
-    area_max = df['Area'].max()
+    idx_pts, idx_poly = gdf.sindex.query(district_gdf.geometry.values, predicate='within')
+    joined = pd.concat([
+        district_gdf.iloc[idx_pts].reset_index(drop=True),
+        gdf.iloc[idx_poly][['REGION_NAM']].reset_index(drop=True)
+    ], axis=1)
 
-    fig.add_trace(go.Scatter(
-        x=df['x'], y=df['y'], mode='markers',
+    region_stats = (
+        pd.DataFrame(joined[['REGION_NAM', 'Rate', 'Area']])
+        .groupby('REGION_NAM', observed=True, sort=False)
+        .agg({'Rate': 'mean', 'Area': 'sum'})
+        .reset_index()
+    )
+    return gdf[['REGION_NAM', 'geometry']].merge(region_stats, on='REGION_NAM', how='left')
+
+# --- Cached chart builders (rebuilt only when the summary data changes) ---
+@st.cache_data(show_spinner=False, max_entries=2)
+def build_area_chart(area_summary):
+    area_fig = go.Figure(go.Bar(
+        x=area_summary['REGION_NAM'].to_numpy(),
+        y=area_summary['Area'].to_numpy(),
+        marker_color='lightgrey'
+    ))
+    area_fig.update_layout(
+        xaxis_title='Region',
+        yaxis_title='Area',
+        xaxis=dict(tickangle=45),
+        height=500,
+        margin=dict(l=40, r=20, t=40, b=120)
+    )
+    return area_fig
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def build_rate_chart(rate_summary):
+    rate_fig = go.Figure(go.Scatter(
+        x=rate_summary['REGION_NAM'].to_numpy(),
+        y=rate_summary['Rate'].to_numpy(),
+        mode='lines+markers',
+        line=dict(color='black', dash='dash'),
+        marker=dict(size=6)
+    ))
+    rate_fig.update_layout(
+        xaxis_title='Region',
+        yaxis_title='Rate',
+        xaxis=dict(tickangle=45),
+        height=500,
+        margin=dict(l=20, r=40, t=40, b=120)
+    )
+    return rate_fig
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def build_rate_legend(rate_min, rate_max):
+    # Stand-alone RdYlGn colourbar for the district layer (pydeck has no legend).
+    legend_fig = go.Figure(go.Scatter(
+        x=[None], y=[None], mode='markers',
         marker=dict(
-            size=20 * df['Area'] / area_max + 5,
-            color=df['Rate'],
-            colorscale='RdYlGn',
-            colorbar=dict(title="Rate", len=0.4, y=0.7),
-            line=dict(color='black', width=0.5),
+            colorscale='RdYlGn', cmin=rate_min, cmax=rate_max, color=[rate_min],
+            colorbar=dict(title="Rate", thickness=15, len=1, x=0, xanchor='left'),
             showscale=True
         ),
-        hoverinfo='text',
-        text=[f"District: {row['DISTRICT']}<br>Rate: {row['Rate']:.2f}<br>Area: {row['Area']:.0f}" for _, row in df.iterrows()],
+        hoverinfo='skip',
         showlegend=False
     ))
-
-    fig.update_layout(
-        title='BC Resource Regions and OG Districts',
-        xaxis=dict(visible=False, scaleanchor='y', scaleratio=1),
-        yaxis=dict(visible=False, scaleanchor='x', scaleratio=1),
-        width=900, height=800,
-        margin=dict(l=50, r=50, t=50, b=160),
+    legend_fig.update_layout(
+        xaxis=dict(visible=False),
+        yaxis=dict(visible=False),
+        height=400,
+        margin=dict(l=0, r=0, t=20, b=20),
         plot_bgcolor='white',
         paper_bgcolor='white'
     )
+    return legend_fig
 
-    st.plotly_chart(fig, use_container_width=True)
+# --- Cached map builder (rebuilt only when the data or selection changes) ---
+# Each entry holds the full region GeoJSON (~0.6 MB); keep a few recent selections only.
+@st.cache_data(show_spinner=False, max_entries=8, ttl=DOWNLOAD_TTL)
+def build_map(data_key, selected, _gdf, _df, _region_lonlat):
+    # data_key identifies _gdf/_df/_region_lonlat (Streamlit skips hashing underscored args).
+    gdf, df = _gdf, _df
+
+    regions = gpd.GeoDataFrame({
+        'selected': gdf['REGION_NAM'].isin(selected).to_numpy(),
+        'label': "Region: " + gdf['REGION_NAM'].astype(str),
+        'rate_text': gdf['Rate'].map('{:.2f}'.format),
+        'area_text': gdf['Area'].map('{:.0f}'.format),
+    }, geometry=_region_lonlat, crs='EPSG:4326')
+    region_layer = pdk.Layer(
+        'GeoJsonLayer',
+        data=regions.__geo_interface__,
+        get_fill_color='properties.selected ? [173, 216, 230] : [211, 211, 211]',
+        get_line_color=[255, 255, 255],
+        line_width_min_pixels=1,
+        pickable=True
+    )
+
+    # --- OG Districts ---
+    district_lonlat = gpd.points_from_xy(df['x'], df['y'], crs='EPSG:3005').to_crs(epsg=4326)
+    district_area = df['Area'].to_numpy()
+    rate = df['Rate'].to_numpy(dtype='float64')
+    has_rate = ~np.isnan(rate)
+    colors = [list(MISSING_RATE_COLOR) for _ in range(len(rate))]
+    if has_rate.any():
+        rate_min, rate_max = np.nanmin(rate), np.nanmax(rate)
+        scaled = (rate[has_rate] - rate_min) / ((rate_max - rate_min) or 1.0)
+        for i, c in zip(np.flatnonzero(has_rate), sample_colorscale('RdYlGn', scaled)):
+            colors[i] = list(unlabel_rgb(c))
+    districts = pd.DataFrame({
+        'lon': district_lonlat.x,
+        'lat': district_lonlat.y,
+        'radius': (20 * np.nan_to_num(district_area / np.nanmax(district_area)) + 5) / 2,
+        'color': colors,
+        'label': "District: " + df['DISTRICT'].astype(str),
+        'rate_text': df['Rate'].map('{:.2f}'.format),
+        'area_text': df['Area'].map('{:.0f}'.format),
+    })
+    district_layer = pdk.Layer(
+        'ScatterplotLayer',
+        data=districts,
+        get_position=['lon', 'lat'],
+        get_radius='radius',
+        radius_units='"pixels"',  # quoted: pydeck treats bare strings as accessors
+        get_fill_color='color',
+        get_line_color=[0, 0, 0],
+        stroked=True,
+        line_width_min_pixels=0.5,
+        pickable=True
+    )
+
+    xmin, ymin, xmax, ymax = regions.total_bounds
+    return pdk.Deck(
+        layers=[region_layer, district_layer],
+        initial_view_state=pdk.ViewState(longitude=(xmin + xmax) / 2, latitude=(ymin + ymax) / 2, zoom=4),
+        map_style=None,
+        tooltip={'html': "{label}<br>Rate: {rate_text}<br>Area: {area_text}"}
+    )
+
+try:
+    # --- Download and read shapefile from GitHub ZIP ---
+    zip_path, zip_key = download_file(zip_url)
+    gdf, region_lonlat = load_shapefile(zip_key, zip_path)
+
+    # --- Load CSV from GitHub ---
+    csv_path, csv_key = download_file(csv_url)
+    df = load_csv(csv_key, csv_path)
+
+    # --- Spatial join + aggregate stats (recomputed only when either file changes) ---
+    data_key = (zip_key, csv_key)
+    if st.session_state.get('stats_key') != data_key:
+        st.session_state['gdf_stats'] = compute_region_stats(gdf, df)
+        names = pd.unique(gdf['REGION_NAM'].to_numpy())
+        st.session_state['region_names'] = np.sort(names[pd.notna(names)])
+        st.session_state['stats_key'] = data_key
+    gdf = st.session_state['gdf_stats']
+    region_names = st.session_state['region_names']
+
+    # --- UI for region selection (applied only on submit) ---
+    with st.form("run"):
+        form_regions = st.multiselect("Select Resource Regions to Highlight", region_names)
+        submitted = st.form_submit_button("Render")
+
+    # --- Main map (last rendered deck is kept across reruns) ---
+    if submitted or st.session_state.get('map_data_key') != data_key:
+        st.session_state['map_regions'] = form_regions
+        st.session_state['map_deck'] = build_map(data_key, tuple(sorted(form_regions)), gdf, df, region_lonlat)
+        st.session_state['map_data_key'] = data_key
+    selected_regions = st.session_state['map_regions']
+
+    st.subheader("BC Resource Regions and OG Districts")
+    map_col, legend_col = st.columns([8, 1])
+    with map_col:
+        st.pydeck_chart(st.session_state['map_deck'], use_container_width=True)
+    with legend_col:
+        if df['Rate'].notna().any():
+            st.plotly_chart(build_rate_legend(df['Rate'].min(), df['Rate'].max()), use_container_width=True)
+        st.caption("District colour: Rate. Grey: no Rate.")
 
     # --- Selected Region Info ---
     if selected_regions:
@@ -143,37 +294,11 @@ try:
 
     with col1:
         st.markdown("**Total Area by Region (sorted by REGION_NAM)**")
-        area_fig = go.Figure(go.Bar(
-            x=area_summary['REGION_NAM'],
-            y=area_summary['Area'],
-            marker_color='lightgrey'
-        ))
-        area_fig.update_layout(
-            xaxis_title='Region',
-            yaxis_title='Area',
-            xaxis=dict(tickangle=45),
-            height=500,
-            margin=dict(l=40, r=20, t=40, b=120)
-        )
-        st.plotly_chart(area_fig, use_container_width=True)
+        st.plotly_chart(build_area_chart(area_summary), use_container_width=True)
 
     with col2:
         st.markdown("**Rate by Region (sorted by Rate)**")
-        rate_fig = go.Figure(go.Scatter(
-            x=rate_summary['REGION_NAM'],
-            y=rate_summary['Rate'],
-            mode='lines+markers',
-            line=dict(color='black', dash='dash'),
-            marker=dict(size=6)
-        ))
-        rate_fig.update_layout(
-            xaxis_title='Region',
-            yaxis_title='Rate',
-            xaxis=dict(tickangle=45),
-            height=500,
-            margin=dict(l=20, r=40, t=40, b=120)
-        )
-        st.plotly_chart(rate_fig, use_container_width=True)
+        st.plotly_chart(build_rate_chart(rate_summary), use_container_width=True)
 
 except Exception as e:
     st.error(f"Error processing files: {str(e)}")